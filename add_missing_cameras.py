@@ -10,122 +10,198 @@ Usage:
 
 Example:
     python3 add_missing_cameras.py --csv tools/nvr_192.168.6.219/192.168.6.219.csv --config config.yaml --network-interface enp6s0
+
+Note:
+    PyYAML's libyaml C bindings are used when available (requires libyaml-dev
+    when building PyYAML); otherwise the pure-Python loader/dumper is used.
 """
 
 import argparse
+import collections
 import csv
+import io
 import os
 import re
+import shutil
 import sys
+import tempfile
+from urllib.parse import urlsplit
+
 import yaml
 
+try:
+    from yaml import CSafeLoader as _Loader, CSafeDumper as _Dumper
+except ImportError:
+    from yaml import SafeLoader as _Loader, SafeDumper as _Dumper
+
+_CHANNEL_RE = re.compile(r'channel=(\d+)')
+_TOP_LEVEL_KEY_RE = re.compile(r'^([^\s#-][^:\n]*):', re.MULTILINE)
+_LIST_ITEM_RE = re.compile(r'^( *)- ', re.MULTILINE)
+
+# A working camera parsed from the nvr-scanner.py CSV
+Camera = collections.namedtuple('Camera', 'name channel hostname rtsp_path width height framerate codec')
+
 
 def parse_csv_file(csv_file):
-    """Parse the CSV file created by nvr-scanner.py and extract camera information."""
-    cameras = []
-    
+    """Parse the CSV file created by nvr-scanner.py and yield camera information."""
     try:
-        with open(csv_file, 'r') as f:
-            reader = csv.DictReader(f)
+        f = open(csv_file, 'r', encoding='utf-8', newline='')
+    except FileNotFoundError:
+        print(f"Error: CSV file {csv_file} does not exist")
+        sys.exit(1)
+    except OSError as e:
+        print(f"Error parsing CSV file: {e}")
+        sys.exit(1)
+    
+    with f:
+        reader = csv.reader(f)
+        
+        # Resolve column indices once from the header row
+        try:
+            header = next(reader)
+            idx = {name: header.index(name) for name in
+                   ('Status', 'Channel', 'RTSP URL', 'Overlay Text', 'Resolution', 'Codec', 'FPS')}
+        except (csv.Error, StopIteration, ValueError) as e:
+            print(f"Error parsing CSV file: {str(e) or 'file is empty'}")
+            sys.exit(1)
+        
+        try:
             for row in reader:
-                # Skip cameras that are not working
-                if row['Status'] != "✅ Working":
+                # Skip blank lines, as csv.DictReader did
+                if not row:
                     continue
                 
-                # Extract camera information
-                channel = row['Channel']
-                rtsp_url = row['RTSP URL']
-                overlay_text = row['Overlay Text']
-                resolution = row['Resolution']
-                codec = row['Codec']
-                fps = row['FPS']
-                
-                # Parse resolution
-                width, height = resolution.split('x')
+                try:
+                    # Skip cameras that are not working
+                    if row[idx['Status']].strip() != "✅ Working":
+                        continue
+                    
+                    # Extract camera information
+                    channel = row[idx['Channel']]
+                    rtsp_url = row[idx['RTSP URL']]
+                    overlay_text = row[idx['Overlay Text']]
+                    resolution = row[idx['Resolution']]
+                    codec = row[idx['Codec']]
+                    fps = row[idx['FPS']]
+                    
+                    # Parse resolution
+                    width, height = resolution.split('x')
+                    width, height = int(width), int(height)
+                    framerate = float(fps) if fps != "N/A" else 30
+                    
+                    # Parse RTSP URL
+                    # Format: rtsp://[username:password@]hostname:port/path
+                    # Strip credentials at the last @ first (passwords may contain
+                    # @, : or /), then let urlsplit handle host and path.
+                    scheme, _, rest = rtsp_url.partition('://')
+                    url = urlsplit(f"{scheme}://{rest.rpartition('@')[2]}")
+                    hostname = url.hostname or ''
+                    rtsp_path = url.path
+                    if url.query:
+                        rtsp_path += '?' + url.query
+                except (IndexError, ValueError) as e:
+                    print(f"Warning: Skipping malformed CSV row {reader.line_num}: {e}")
+                    continue
                 
                 # Create camera name by replacing spaces with hyphens
                 camera_name = overlay_text.strip().replace(' ', '-')
                 
-                # Parse RTSP URL more robustly
-                # Format: rtsp://[username:password@]hostname:port/path
-                
-                # First, find the last @ symbol (in case password contains @)
-                parts = rtsp_url.split('://', 1)[1]
-                last_at_index = parts.rfind('@')
-                
-                if last_at_index != -1:
-                    # URL has credentials
-                    host_port_path = parts[last_at_index + 1:]
-                else:
-                    # URL has no credentials
-                    host_port_path = parts
-                
-                # Now extract hostname and path
-                host_port, path = host_port_path.split('/', 1)
-                hostname, port = host_port.split(':')
-                rtsp_path = '/' + path
-                
                 # Validate the extracted hostname and path
                 if not hostname or not rtsp_path:
                     print(f"Warning: Could not extract hostname or path from URL: {rtsp_url}")
                     print(f"Extracted hostname: {hostname}, path: {rtsp_path}")
                     continue
                 
-                # Create camera configuration
-                camera = {
-                    'name': camera_name,
-                    'channel': channel,
-                    'hostname': hostname,
-                    'rtsp_path': rtsp_path,
-                    'width': int(width),
-                    'height': int(height),
-                    'framerate': float(fps) if fps != "N/A" else 30,
-                    'codec': codec if codec != "N/A" else "h264"
-                }
-                
-                cameras.append(camera)
-        
-        return cameras
-    
+                yield Camera(
+                    name=camera_name,
+                    channel=channel,
+                    hostname=hostname,
+                    rtsp_path=rtsp_path,
+                    width=width,
+                    height=height,
+                    framerate=framerate,
+                    codec=codec if codec != "N/A" else "h264"
+                )
+        except (csv.Error, UnicodeDecodeError) as e:
+            print(f"Error parsing CSV file: {e}")
+            sys.exit(1)
+
+
+def read_config_file(config_file):
+    """Read the existing config.yaml file as text."""
+    try:
+        with open(config_file, 'r', encoding='utf-8') as f:
+            return f.read()
+    except FileNotFoundError:
+        print(f"Error: Config file {config_file} does not exist")
+        sys.exit(1)
     except Exception as e:
-        print(f"Error parsing CSV file: {e}")
+        print(f"Error parsing config file: {e}")
         sys.exit(1)
 
 
-def parse_config_file(config_file):
-    """Parse the existing config.yaml file."""
+def parse_config_file(config_text):
+    """Parse the existing config.yaml text."""
     try:
-        with open(config_file, 'r') as f:
-            config = yaml.safe_load(f)
-            return config
+        return yaml.load(config_text, Loader=_Loader)
     except Exception as e:
         print(f"Error parsing config file: {e}")
         sys.exit(1)
 
 
+def find_onvif_section(text):
+    """Return (start, end, item indent) of the block-style onvif list in the config text, or None."""
+    keys = list(_TOP_LEVEL_KEY_RE.finditer(text))
+    for i, key in enumerate(keys):
+        if key.group(1).strip() == 'onvif':
+            end = keys[i + 1].start() if i + 1 < len(keys) else len(text)
+            item_match = _LIST_ITEM_RE.search(text, key.end(), end)
+            if not item_match:
+                return None
+            return key.end(), end, item_match.group(1)
+    return None
+
+
+def scan_config_camera_names(text):
+    """Collect plain string `name:` values of onvif list items without parsing the YAML."""
+    # Limit the scan to the onvif section and the indentation of its items
+    section = find_onvif_section(text)
+    if not section:
+        return set()
+    start, end, item_indent = section
+    indent = len(item_indent)
+    name_re = re.compile(rf"^(?: {{{indent}}}- | {{{indent + 2}}})name:[ \t]*([^\s'\"&*!|>%@`{{\[#]\S*)[ \t]*\r?$",
+                         re.MULTILINE)
+    
+    # Skip values the YAML loader would not load as plain strings (e.g. `name: 101`)
+    resolver = yaml.resolver.Resolver()
+    return {name for name in name_re.findall(text, start, end)
+            if resolver.resolve(yaml.ScalarNode, name, (True, False)) == 'tag:yaml.org,2002:str'}
+
+
 def find_missing_cameras(csv_cameras, config):
     """Find cameras that are in the CSV file but not in the config file."""
     missing_cameras = []
     
     # Get existing camera names from config
-    existing_camera_names = []
-    existing_camera_channels = []
+    existing_camera_names = set()
+    existing_camera_channels = set()
     
     if 'onvif' in config and isinstance(config['onvif'], list):
         for camera in config['onvif']:
             if 'name' in camera:
-                existing_camera_names.append(camera['name'])
+                existing_camera_names.add(camera['name'])
             
             # Extract channel number from RTSP path
             if 'highQuality' in camera and 'rtsp' in camera['highQuality']:
                 rtsp_path = camera['highQuality']['rtsp']
-                channel_match = re.search(r'channel=(\d+)', rtsp_path)
+                channel_match = _CHANNEL_RE.search(rtsp_path)
                 if channel_match:
-                    existing_camera_channels.append(channel_match.group(1))
+                    existing_camera_channels.add(channel_match.group(1))
     
     # Find missing cameras
     for camera in csv_cameras:
-        if camera['name'] not in existing_camera_names and camera['channel'] not in existing_camera_channels:
+        if camera.name not in existing_camera_names and camera.channel not in existing_camera_channels:
             missing_cameras.append(camera)
     
     return missing_cameras
@@ -136,19 +212,14 @@ def add_cameras_to_config(missing_cameras, config, network_interface):
     if 'onvif' not in config:
         config['onvif'] = []
     
-    # Find the highest port numbers currently in use
-    highest_server_port = 8081
-    highest_rtsp_port = 8554
-    highest_snapshot_port = 8080
-    
-    for camera in config['onvif']:
-        if 'ports' in camera:
-            if 'server' in camera['ports'] and camera['ports']['server'] > highest_server_port:
-                highest_server_port = camera['ports']['server']
-            if 'rtsp' in camera['ports'] and camera['ports']['rtsp'] > highest_rtsp_port:
-                highest_rtsp_port = camera['ports']['rtsp']
-            if 'snapshot' in camera['ports'] and camera['ports']['snapshot'] > highest_snapshot_port:
-                highest_snapshot_port = camera['ports']['snapshot']
+    # Find the highest port numbers currently in use (never below the defaults)
+    all_ports = [camera.get('ports') or {} for camera in config['onvif']]
+    highest_server_port = max(8081, max(
+        (ports['server'] for ports in all_ports if 'server' in ports), default=8081))
+    highest_rtsp_port = max(8554, max(
+        (ports['rtsp'] for ports in all_ports if 'rtsp' in ports), default=8554))
+    highest_snapshot_port = max(8080, max(
+        (ports['snapshot'] for ports in all_ports if 'snapshot' in ports), default=8080))
     
     # Add missing cameras
     for camera in missing_cameras:
@@ -159,21 +230,21 @@ def add_cameras_to_config(missing_cameras, config, network_interface):
         
         # Create camera configuration
         camera_config = {
-            'name': camera['name'],
+            'name': camera.name,
             'dev': network_interface,
             'target': {
-                'hostname': camera['hostname'],
+                'hostname': camera.hostname,
                 'ports': {
                     'rtsp': 554,
                     'snapshot': 80
                 }
             },
             'highQuality': {
-                'rtsp': camera['rtsp_path'],
+                'rtsp': camera.rtsp_path,
                 'snapshot': '/onvif-http/snapshot',
-                'width': camera['width'],
-                'height': camera['height'],
-                'framerate': camera['framerate'],
+                'width': camera.width,
+                'height': camera.height,
+                'framerate': camera.framerate,
                 'bitrate': 2048,
                 'quality': 4
             },
@@ -190,14 +261,71 @@ def add_cameras_to_config(missing_cameras, config, network_interface):
 
 
 def save_config_file(config, config_file):
-    """Save the updated config to the config file."""
+    """Atomically save the updated config to the config file, skipping unchanged content."""
+    tmp_file = None
     try:
-        with open(config_file, 'w') as f:
-            yaml.dump(config, f, default_flow_style=False)
+        buf = io.StringIO()
+        yaml.dump(config, buf, Dumper=_Dumper, default_flow_style=False,
+                  sort_keys=False, width=1_000_000, allow_unicode=True)
+        data = buf.getvalue().encode('utf-8')
+        
+        try:
+            with open(config_file, 'rb') as f:
+                if f.read() == data:
+                    print(f"Config file {config_file} is unchanged")
+                    return
+        except FileNotFoundError:
+            pass
+        
+        # Write to a temporary file next to the config, then replace it
+        with tempfile.NamedTemporaryFile('wb', dir=os.path.dirname(os.path.abspath(config_file)),
+                                         suffix='.tmp', delete=False) as f:
+            tmp_file = f.name
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        if os.path.exists(config_file):
+            shutil.copymode(config_file, tmp_file)
+        os.replace(tmp_file, config_file)
+        tmp_file = None
         print(f"Updated config file saved to {config_file}")
     except Exception as e:
         print(f"Error saving config file: {e}")
         sys.exit(1)
+    finally:
+        if tmp_file is not None:
+            try:
+                os.unlink(tmp_file)
+            except OSError:
+                pass
+
+
+def append_cameras_to_config_file(camera_configs, config_file, text):
+    """Append new camera entries to the config file's onvif list, returning False if the layout doesn't allow it."""
+    try:
+        # onvif must be the last top-level key with at least one block-style item
+        section = find_onvif_section(text)
+        if not section:
+            return False
+        _, end, indent = section
+        if end != len(text):
+            return False
+        
+        data = yaml.dump(camera_configs, Dumper=_Dumper, default_flow_style=False,
+                         sort_keys=False, width=1_000_000, allow_unicode=True)
+        data = ''.join(indent + line for line in data.splitlines(keepends=True))
+        
+        # Written in place: unlike save_config_file this is not an atomic
+        # temp-file-and-replace, so a failed write can leave a partial entry.
+        with open(config_file, 'a', encoding='utf-8') as f:
+            if text and not text.endswith('\n'):
+                f.write('\n')
+            f.write(data)
+        print(f"Appended {len(camera_configs)} cameras to {config_file}")
+        return True
+    except Exception as e:
+        print(f"Error saving config file: {e}")
+        sys.exit(1)
 
 
 def main():
@@ -208,23 +336,24 @@ def main():
     parser.add_argument('--network-interface', default='enp6s0', help='Network interface to use (default: enp6s0)')
     args = parser.parse_args()
     
-    # Check if files exist
-    if not os.path.exists(args.csv):
-        print(f"Error: CSV file {args.csv} does not exist")
-        sys.exit(1)
-    
-    if not os.path.exists(args.config):
-        print(f"Error: Config file {args.config} does not exist")
-        sys.exit(1)
-    
     # Parse CSV file
     print(f"Parsing CSV file: {args.csv}")
-    csv_cameras = parse_csv_file(args.csv)
+    csv_cameras = list(parse_csv_file(args.csv))
     print(f"Found {len(csv_cameras)} working cameras in CSV file")
     
+    # Read the config once; the name scan, YAML parse and append all share it
+    config_text = read_config_file(args.config)
+    
+    # Skip the full config parse when every CSV camera name is already present.
+    # This is only a text scan: it does not validate the YAML, so a broken
+    # config that already lists every camera is not reported here.
+    if {camera.name for camera in csv_cameras} <= scan_config_camera_names(config_text):
+        print("No missing cameras found. Config file is up to date.")
+        return
+    
     # Parse config file
     print(f"Parsing config file: {args.config}")
-    config = parse_config_file(args.config)
+    config = parse_config_file(config_text)
     
     # Find missing cameras
     print("Finding missing cameras...")
@@ -238,7 +367,7 @@ def main():
     # Print missing cameras
     print("\nMissing cameras:")
     for camera in missing_cameras:
-        print(f"  - Channel {camera['channel']}: {camera['name']} ({camera['width']}x{camera['height']})")
+        print(f"  - Channel {camera.channel}: {camera.name} ({camera.width}x{camera.height})")
     
     # Add missing cameras to config
     print("\nAdding missing cameras to config...")
@@ -246,7 +375,9 @@ def main():
     
     # Save updated config
     print("\nSaving updated config...")
-    save_config_file(updated_config, args.config)
+    new_camera_configs = updated_config['onvif'][-len(missing_cameras):]
+    if not append_cameras_to_config_file(new_camera_configs, args.config, config_text):
+        save_config_file(updated_config, args.config)
     
     print("\nDone! Please restart the Docker container to apply the changes:")
     print("  sudo docker compose down && sudo docker compose up -d")